@@ -3,15 +3,24 @@
 
 import asyncio
 import hashlib
+import multiprocessing
 import os
-import json
-from typing import List, Dict, Any, Optional
-from datetime import datetime
+import re
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache, partial
+from typing import List, Dict, Any, Iterator, NamedTuple, Optional, Set, Tuple, Union
+from datetime import datetime, timezone
+from enum import IntEnum
 from pathlib import Path
 
-import fitz 
-from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks
-from fastapi.responses import JSONResponse, FileResponse
+import numpy as np
+import orjson
+from cachetools import TTLCache
+from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, Request, Response
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from loguru import logger
@@ -19,10 +28,14 @@ from pydantic import BaseModel
 from tiktoken import get_encoding
 
 # API-based services
-import requests
+import httpx
 from pinecone import Pinecone
 from supabase import create_client, Client
-from groq import Groq
+from postgrest.exceptions import APIError
+from postgrest.types import ReturnMethod
+from groq import AsyncGroq, RateLimitError
+
+from pdf_extract import TextBlocks, count_pages, empty_text_blocks, extract_page_range
 
 # Configure logger for production
 logger.remove()
@@ -65,6 +78,8 @@ if PINECONE_API_KEY:
         logger.error(f"❌ Failed to initialize Pinecone: {e}")
 else:
     logger.warning("⚠️ PINECONE_API_KEY not set. Vector search will be disabled.")
+# Opened on first use by _get_pinecone_index() and shared, so its async_req thread pool is started only once
+pinecone_index = None
 
 # Supabase
 supabase_client: Optional[Client] = None
@@ -77,6 +92,34 @@ if SUPABASE_URL and SUPABASE_KEY:
 else:
     logger.warning("⚠️ Supabase credentials not set. Database operations will be disabled.")
 
+# Direct PostgREST client for hot read paths; keeps connections alive across requests
+pgrest: Optional[httpx.AsyncClient] = None
+if supabase_client:
+    pgrest = httpx.AsyncClient(
+        base_url=f"{SUPABASE_URL}/rest/v1",
+        headers={"apikey": SUPABASE_KEY, "Authorization": f"Bearer {SUPABASE_KEY}"},
+        limits=httpx.Limits(max_keepalive_connections=20),
+        timeout=5.0,
+    )
+
+# Groq
+llm_client: Optional[AsyncGroq] = None
+if GROQ_API_KEY:
+    try:
+        # Analysis fans out many concurrent completions; keep enough warm connections for them
+        llm_client = AsyncGroq(
+            api_key=GROQ_API_KEY,
+            http_client=httpx.AsyncClient(
+                timeout=httpx.Timeout(60.0, connect=5.0),
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+            ),
+        )
+        logger.info("✅ Groq client initialized.")
+    except Exception as e:
+        logger.error(f"❌ Failed to create Groq client: {e}")
+else:
+    logger.warning("⚠️ GROQ_API_KEY not set. LLM analysis will be disabled.")
+
 # Local file storage for PDFs (robust for restricted environments like HF Spaces)
 # Prefer env var if provided; else try local folder; fall back to /tmp/uploads when not writeable
 def _resolve_uploads_dir() -> Path:
@@ -108,134 +151,316 @@ logger.info(f"📁 Using uploads directory: {UPLOADS_DIR}")
 
 # --- Production-Ready Core Functions ---
 
-def get_llm_client() -> Optional[Groq]:
-    """Initializes and returns a Groq client if the API key is available."""
-    if not GROQ_API_KEY:
-        logger.error("❌ GROQ_API_KEY not set. LLM analysis is disabled.")
-        return None
+# Supabase calls get their own threads so file I/O and Pinecone work can't starve them
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+_db_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="supabase")
+
+async def _db(fn, *args, **kwargs):
+    """Runs a blocking Supabase call in a worker thread so it doesn't stall the event loop."""
+    return await asyncio.get_running_loop().run_in_executor(_db_executor, partial(fn, *args, **kwargs))
+
+async def _rest_get(table: str, params: Dict[str, str]) -> List[Dict[str, Any]]:
+    """Reads rows straight from PostgREST on the shared async client (no worker thread)."""
+    resp = await pgrest.get(f"/{table}", params=params)
+    resp.raise_for_status()
+    return orjson.loads(resp.content)
+
+# Shared cap on values per `in` filter, so every batched lookup (cache keys, document ids) keeps
+# its request URL to a few KB; 100 quoted SHA-256 ids is ~7KB
+IN_FILTER_BATCH_SIZE = 100
+
+def _in_filter(values: List[str]) -> str:
+    """Builds a PostgREST `in.(...)` filter with each value double-quoted."""
+    quoted = ('"' + v.replace('\\', '\\\\').replace('"', '\\"') + '"' for v in values)
+    return f"in.({','.join(quoted)})"
+
+# --- Supabase-backed Cache ---
+# Entries live in the 'cache' table (JSONB values), namespaced by key prefix: "blocks:", "analysis:", "emb:".
+
+
+# Punctuation is dropped unless it sits between digits, so "$5,000" and "$50.00" stay distinct
+_CACHE_PUNCT_RE = re.compile(r'(?<!\d)[^\w\s]|[^\w\s](?!\d)')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+def _content_hash(text: str) -> str:
+    """128-bit hash of text normalised for case, whitespace and punctuation drift between extractions."""
+    normalized = _WHITESPACE_RE.sub(' ', _CACHE_PUNCT_RE.sub('', text.lower())).strip()
+    return hashlib.blake2b(normalized.encode(), digest_size=16).hexdigest()
+
+def _load_cache_value(value: Any) -> Any:
+    """cache.value is JSONB and arrives decoded; rows written before the migration hold JSON strings."""
+    return orjson.loads(value) if isinstance(value, str) else value
+
+async def get_cached_values(keys: List[str]) -> Dict[str, Any]:
+    """Fetches cached values for many keys with batched IN queries."""
+    cached: Dict[str, Any] = {}
+    if not supabase_client or not keys:
+        return cached
+    unique_keys = list(dict.fromkeys(keys))
     try:
-        return Groq(api_key=GROQ_API_KEY)
+        # Keep each IN list short enough for the request URL
+        for start in range(0, len(unique_keys), IN_FILTER_BATCH_SIZE):
+            batch = unique_keys[start:start + IN_FILTER_BATCH_SIZE]
+            response = await _db(supabase_client.table('cache').select('key,value').in_('key', batch).execute)
+            for row in response.data:
+                cached[row['key']] = _load_cache_value(row['value'])
     except Exception as e:
-        logger.error(f"❌ Failed to create Groq client: {e}")
-        return None
+        logger.warning(f"⚠️ Cache lookup failed: {e}")
+    return cached
 
-async def get_embeddings_huggingface(texts: List[str]) -> List[List[float]]:
-    """Get embeddings using Hugging Face Inference API with requests."""
+async def save_cached_values(values: Dict[str, Any]):
+    """Stores new cache entries with a single upsert (keys are unique per statement)."""
+    if not supabase_client or not values:
+        return
+    try:
+        await _db(supabase_client.table('cache').upsert([
+            {'key': key, 'value': value} for key, value in values.items()
+        ]).execute)
+    except Exception as e:
+        logger.warning(f"⚠️ Cache save failed: {e}")
+
+def get_llm_client() -> Optional[AsyncGroq]:
+    """Returns the shared async Groq client, or None if LLM analysis is disabled."""
+    if not llm_client:
+        logger.error("❌ Groq client not available. LLM analysis is disabled.")
+    return llm_client
+
+HF_EMBEDDING_MODEL = "sentence-transformers/all-mpnet-base-v2"
+EMBEDDING_DIM = 768
+HF_BATCH_SIZE = 32
+HF_BATCH_MAX_TOKENS = 8192
+HF_CONCURRENCY = int(os.getenv("HF_CONCURRENCY", "4"))
+
+# Shared async HTTP client so embedding batches reuse keep-alive connections
+http_client = httpx.AsyncClient(timeout=30)
+
+def _batch_texts(texts: List[str], token_counts: Optional[List[int]] = None) -> List[List[int]]:
+    """Groups text indices into sub-batches bounded by count and total tokens."""
+    if token_counts is None:
+        token_counts = [len(TOKENIZER.encode_ordinary(text)) for text in texts]
+    batches: List[List[int]] = []
+    current: List[int] = []
+    current_tokens = 0
+    for i, tokens in enumerate(token_counts):
+        if current and (len(current) >= HF_BATCH_SIZE or current_tokens + tokens > HF_BATCH_MAX_TOKENS):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+EMBEDDING_LRU_SIZE = 4096
+_embedding_lru: "OrderedDict[str, List[float]]" = OrderedDict()
+
+def _embedding_cache_key(text: str) -> str:
+    return f"emb:{_content_hash(text)}"
+
+def _remember_embedding(key: str, embedding: List[float]):
+    _embedding_lru[key] = embedding
+    _embedding_lru.move_to_end(key)
+    if len(_embedding_lru) > EMBEDDING_LRU_SIZE:
+        _embedding_lru.popitem(last=False)
+
+async def _request_embeddings(texts: List[str], token_counts: Optional[List[int]] = None) -> List[Optional[List[float]]]:
+    """Calls the HF Inference API in batches; None marks texts that could not be embedded."""
+    headers = {
+        "Authorization": f"Bearer {HF_API_KEY}",
+        "Content-Type": "application/json"
+    }
+    url = f"https://api-inference.huggingface.co/models/{HF_EMBEDDING_MODEL}"
+    sem = asyncio.Semaphore(HF_CONCURRENCY)
+
+    async def _post(inputs: List[str]) -> Tuple[Optional[List[List[float]]], bool]:
+        """Returns (rows, retry_singly); retry_singly means the model rejected list input."""
+        async with sem:
+            try:
+                response = await http_client.post(url, headers=headers, content=orjson.dumps({"inputs": inputs}))
+            except httpx.HTTPError as e:
+                logger.debug(f"⚠️ HF API request failed: {e}")
+                return None, False
+        if response.status_code != 200:
+            logger.debug(f"⚠️ HF API HTTP {response.status_code}: {response.text[:120]}")
+            return None, response.status_code in (400, 422)
+        data = orjson.loads(response.content)
+        # Batched inputs return one row per input, in order
+        if isinstance(data, list) and len(data) == len(inputs):
+            return data, False
+        if len(inputs) == 1:
+            # Some models return {"embedding": [...]} or a bare vector for a single input
+            if isinstance(data, dict) and "embedding" in data:
+                return [data["embedding"]], False
+            if isinstance(data, list) and data and not isinstance(data[0], list):
+                return [data], False
+        logger.warning(f"⚠️ Unexpected HF response format: {type(data)}")
+        return None, True
+
+    async def _embed_batch(batch: List[int]) -> List[Optional[List[float]]]:
+        rows, retry_singly = await _post([texts[i] for i in batch])
+        if rows is not None:
+            return rows
+        if retry_singly and len(batch) > 1:
+            # The model doesn't accept list inputs: send each text concurrently instead
+            singles = await asyncio.gather(*[_post([texts[i]]) for i in batch])
+            return [single[0] if single else None for single, _ in singles]
+        return [None] * len(batch)
+
+    batches = _batch_texts(texts, token_counts)
+    results = await asyncio.gather(*[_embed_batch(batch) for batch in batches])
+
+    embeddings: List[Optional[List[float]]] = [None] * len(texts)
+    for batch, rows in zip(batches, results):
+        for i, row in zip(batch, rows):
+            embeddings[i] = row
+    return embeddings
+
+async def get_embeddings_huggingface(texts: List[str], token_counts: Optional[List[int]] = None) -> List[List[float]]:
+    """Get embeddings for texts, serving repeats from the in-process and Supabase caches."""
     if not HF_API_KEY:
         logger.error("❌ HF_API_KEY not set. Cannot generate embeddings.")
         raise HTTPException(status_code=500, detail="Embedding service is not configured.")
 
     try:
-        import requests
-        
-        headers = {
-            "Authorization": f"Bearer {HF_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        model = "sentence-transformers/all-mpnet-base-v2"
-        
-        embeddings = []
-        for text in texts:
-            response = requests.post(
-                f"https://api-inference.huggingface.co/models/{model}",
-                headers=headers,
-                json={"inputs": [text]},
-                timeout=30
+        keys = [_embedding_cache_key(text) for text in texts]
+        resolved: Dict[str, List[float]] = {key: _embedding_lru[key] for key in keys if key in _embedding_lru}
+
+        # One index per distinct uncached text
+        missing = {key: i for i, key in enumerate(keys) if key not in resolved}
+        if missing:
+            stored = await get_cached_values(list(missing))
+            resolved.update(stored)
+            missing = {key: i for key, i in missing.items() if key not in stored}
+
+        if missing:
+            indices = list(missing.values())
+            fetched = await _request_embeddings(
+                [texts[i] for i in indices],
+                [token_counts[i] for i in indices] if token_counts else None,
             )
-            if response.status_code == 200:
-                data = response.json()
-                # Preferred response format: {"embedding": [...] }
-                if isinstance(data, dict) and "embedding" in data:
-                    embeddings.append(data["embedding"])
-                    continue
-                # Fallback: some models return list directly
-                if isinstance(data, list):
-                    embeddings.append(data[0] if isinstance(data[0], list) else data)
-                    continue
-                logger.warning(f"⚠️ Unexpected HF response format: {type(data)}")
-            else:
-                logger.debug(f"⚠️ HF API HTTP {response.status_code}: {response.text[:120]}")
-            # Fallback embedding when HF call fails
-            embeddings.append(_get_fallback_embedding(text))
-        
-        logger.info(f"✅ Generated {len(embeddings)} embeddings using HF API")
-        return embeddings
-        
+            new_entries = {key: embedding for key, embedding in zip(missing, fetched) if embedding is not None}
+            resolved.update(new_entries)
+            await save_cached_values(new_entries)
+            logger.info(f"✅ Generated {len(new_entries)} embeddings using HF API")
+
+        for key, embedding in resolved.items():
+            _remember_embedding(key, embedding)
+        embeddings = [resolved.get(key) for key in keys]
+
+        # Fallback embedding for any text whose HF call failed (never cached)
+        failed = sum(1 for emb in embeddings if emb is None)
+        if failed:
+            logger.warning(f"⚠️ Using fallback embeddings for {failed} texts")
+        return [emb if emb is not None else _get_fallback_embedding(text)
+                for text, emb in zip(texts, embeddings)]
+
     except Exception as e:
         logger.error(f"❌ Hugging Face API error during embedding generation: {e}")
         # Return fallback embeddings instead of raising exception
         return [_get_fallback_embedding(text) for text in texts]
 
+@lru_cache(maxsize=1024)
 def _get_fallback_embedding(text: str) -> List[float]:
-    """Generate fallback embedding using hash for 768 dimensions."""
-    import hashlib
-    hash_obj = hashlib.md5(text.encode())
-    # all-mpnet-base-v2 has 768 dimensions
-    return [float(x) / 255.0 for x in hash_obj.digest()] * 48  # 768 dimensions
+    """Deterministic unit-norm pseudo-embedding (768-d, like all-mpnet-base-v2) seeded by the text hash."""
+    seed = int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "little")
+    vector = np.random.default_rng(seed).standard_normal(EMBEDDING_DIM, dtype=np.float32)
+    vector /= np.linalg.norm(vector)
+    return vector.tolist()
 
 # --- PDF Processing and Chunking ---
 
-def _sync_extract_with_coordinates(pdf_bytes: bytes) -> List[Dict[str, Any]]:
+def _iter_blocks(text_blocks: TextBlocks) -> Iterator[Tuple[str, int, List[float]]]:
+    """Yields (text, page, bbox) for each block of a struct-of-arrays block set."""
+    return zip(text_blocks["text"], text_blocks["page"], text_blocks["bbox"])
+
+PDF_PAGES_PER_WORKER = 8
+# Each worker opens its own copy of the document, so keep the pool small on shared hosts
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(min(os.cpu_count() or 1, 4))))
+# Below this many pages, process start-up and IPC cost more than parallel parsing saves
+PDF_PARALLEL_MIN_PAGES = 2 * PDF_PAGES_PER_WORKER
+
+_pdf_executor: Optional[ProcessPoolExecutor] = None
+
+def _get_pdf_executor() -> ProcessPoolExecutor:
+    global _pdf_executor
+    if _pdf_executor is None:
+        # forkserver, not fork: by now the process runs DB/anyio/Pinecone threads, and forking
+        # mid-flight can leave a child holding a lock no thread will ever release. Workers only
+        # need pdf_extract (fitz); preloading it in the forkserver means each worker forks with
+        # it imported, and never loads this module's clients, tokenizer or app
+        mp_context = multiprocessing.get_context("forkserver")
+        mp_context.set_forkserver_preload(["__main__", "pdf_extract"])
+        _pdf_executor = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=mp_context)
+    return _pdf_executor
+
+def _sync_extract_with_coordinates(pdf_path: str) -> TextBlocks:
     """Synchronous core logic for text and coordinate extraction."""
-    text_blocks = []
-    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
-        for page_num, page in enumerate(doc, 1):
-            blocks = page.get_text("dict").get("blocks", [])
-            for block in blocks:
-                if "lines" in block:
-                    for line in block["lines"]:
-                        for span in line["spans"]:
-                            if span["text"].strip():
-                                text_blocks.append({
-                                    "text": span["text"].strip(),
-                                    "page_num": page_num,
-                                    "coordinates": list(span["bbox"]),
-                                    "block_id": f"p{page_num}b{len(text_blocks)}"
-                                })
-    return text_blocks
+    return extract_page_range(pdf_path, 0)
 
-async def extract_text_with_coordinates(pdf_bytes: bytes) -> List[Dict[str, Any]]:
-    """Extracts text blocks with page numbers and coordinates from a PDF."""
+async def extract_text_with_coordinates(pdf_path: str) -> TextBlocks:
+    """Extracts text blocks with page numbers and coordinates from a PDF on disk."""
     loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, _sync_extract_with_coordinates, pdf_bytes)
+    page_count = await loop.run_in_executor(None, count_pages, pdf_path)
+    if page_count < PDF_PARALLEL_MIN_PAGES or PDF_WORKERS < 2:
+        return await loop.run_in_executor(None, _sync_extract_with_coordinates, pdf_path)
+
+    # Parse page ranges in parallel worker processes, then merge in page order
+    executor = _get_pdf_executor()
+    parts = await asyncio.gather(*[
+        loop.run_in_executor(executor, extract_page_range, pdf_path, start,
+                             min(start + PDF_PAGES_PER_WORKER, page_count))
+        for start in range(0, page_count, PDF_PAGES_PER_WORKER)
+    ])
+    text_blocks = empty_text_blocks()
+    for part in parts:
+        for key, values in part.items():
+            text_blocks[key].extend(values)
+    return text_blocks
+
+# Loaded eagerly so the BPE tables are read once at startup rather than on the first upload
+TOKENIZER = get_encoding("cl100k_base")
 
-async def chunk_text_with_coordinates(text_blocks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+async def chunk_text_with_coordinates(text_blocks: TextBlocks) -> List[Dict[str, Any]]:
     """Creates semantic chunks from text blocks while preserving location info."""
     chunks = []
     current_chunk_text = ""
-    current_chunk_blocks = []
+    current_page = 0
+    current_coordinates = []
+    current_tokens = 0
     
-    enc = get_encoding("cl100k_base")
     CHUNK_SIZE_TOKENS = 250
     MIN_CHUNK_SIZE_CHARS = 50
 
-    for block in text_blocks:
-        block_text = block["text"]
-        
-        if (enc.encode(current_chunk_text + " " + block_text)) and (len(enc.encode(current_chunk_text + " " + block_text)) > CHUNK_SIZE_TOKENS):
-            if len(current_chunk_text) >= MIN_CHUNK_SIZE_CHARS:
-                first_block = current_chunk_blocks[0]
-                chunks.append({
-                    "id": f"chunk_{len(chunks)}",
-                    "text": current_chunk_text.strip(),
-                    "page_num": first_block["page_num"],
-                    "coordinates": [b["coordinates"] for b in current_chunk_blocks],
-                    "token_count": len(enc.encode(current_chunk_text))
-                })
+    for block_text, page_num, bbox in _iter_blocks(text_blocks):
+        # Encode each block once and keep a running total instead of re-encoding the buffer
+        block_tokens = len(TOKENIZER.encode_ordinary(" " + block_text))
+        
+        # Short buffers keep growing rather than being flushed (and dropped) below the minimum size
+        if current_tokens + block_tokens > CHUNK_SIZE_TOKENS and len(current_chunk_text) >= MIN_CHUNK_SIZE_CHARS:
+            chunks.append({
+                "id": f"chunk_{len(chunks)}",
+                "text": current_chunk_text.strip(),
+                "page_num": current_page,
+                "coordinates": current_coordinates,
+                "token_count": current_tokens
+            })
             current_chunk_text = ""
-            current_chunk_blocks = []
+            current_coordinates = []
+            current_tokens = 0
 
+        if not current_coordinates:
+            current_page = page_num
         current_chunk_text += " " + block_text
-        current_chunk_blocks.append(block)
+        current_coordinates.append(bbox)
+        current_tokens += block_tokens
 
     if current_chunk_text and len(current_chunk_text) >= MIN_CHUNK_SIZE_CHARS:
-        first_block = current_chunk_blocks[0]
         chunks.append({
             "id": f"chunk_{len(chunks)}",
             "text": current_chunk_text.strip(),
-            "page_num": first_block["page_num"],
-            "coordinates": [b["coordinates"] for b in current_chunk_blocks],
-            "token_count": len(enc.encode(current_chunk_text))
+            "page_num": current_page,
+            "coordinates": current_coordinates,
+            "token_count": current_tokens
         })
 
     logger.info(f"✅ Created {len(chunks)} chunks.")
@@ -261,18 +486,36 @@ TEXT TO ANALYZE:
 {text_content}
 """
 
-async def analyze_chunk_for_concerns(llm: Groq, chunk: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
+LLM_MAX_RETRIES = 3
+
+# Chunks with none of these concern indicators (page headers, TOC lines, etc.) skip the LLM
+_CONCERN_RE = re.compile(
+    r"\b(exclu|waiting|deduct|co-?pay|co-?insur|not covered|limit|sub-?limit|subrogat|pre-?existing"
+    r"|network|claim|renew|cancel|terminat|must|shall|oblig|notif|reimburs|maximum)\w*",
+    re.IGNORECASE,
+)
+
+_llm_semaphore: Optional[asyncio.Semaphore] = None
+
+def _get_llm_semaphore() -> asyncio.Semaphore:
+    """Process-wide cap on in-flight LLM calls, created lazily inside the running loop."""
+    global _llm_semaphore
+    if _llm_semaphore is None:
+        _llm_semaphore = asyncio.Semaphore(LLM_CONCURRENCY)
+    return _llm_semaphore
+
+def _analysis_cache_key(text: str) -> str:
+    return f"analysis:{_content_hash(text)}"
+
+async def analyze_chunk_for_concerns(llm: AsyncGroq, chunk: Dict[str, Any],
+                                     cached: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
     """Analyzes a single text chunk for insurance concerns using the LLM."""
     if not llm: return None
-    
-    cache_key = f"analysis:{hashlib.sha1(chunk['text'].encode()).hexdigest()}"
-    if supabase_client:
-        try:
-            response = supabase_client.table('cache').select('value').eq('key', cache_key).execute()
-            if response.data:
-                return json.loads(response.data[0]['value'])
-        except Exception as e:
-            logger.warning(f"⚠️ Cache lookup failed: {e}")
+    if cached is not None:
+        return cached
+    if not _CONCERN_RE.search(chunk['text']):
+        return None
 
     try:
         # Provide a structured format for the model to follow
@@ -290,13 +533,23 @@ async def analyze_chunk_for_concerns(llm: Groq, chunk: Dict[str, Any]) -> Option
         {chunk['text']}
         """
         
-        response = await asyncio.to_thread(
-            llm.chat.completions.create,
-            messages=[{"role": "user", "content": prompt}],
-            model="llama-3.1-8b-instant",
-            temperature=0.0,
-            max_tokens=350,
-        )
+        # This loop is the only retry: the SDK's own retries would sleep while holding a semaphore slot
+        llm = llm.with_options(max_retries=0)
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            try:
+                async with _get_llm_semaphore():
+                    response = await llm.chat.completions.create(
+                        messages=[{"role": "user", "content": prompt}],
+                        model="llama-3.1-8b-instant",
+                        temperature=0.0,
+                        max_tokens=350,
+                    )
+                break
+            except RateLimitError:
+                if attempt == LLM_MAX_RETRIES:
+                    raise
+                # Back off outside the semaphore so other chunks can proceed
+                await asyncio.sleep(2 ** attempt)
         
         result_text = response.choices[0].message.content
         
@@ -304,14 +557,6 @@ async def analyze_chunk_for_concerns(llm: Groq, chunk: Dict[str, Any]) -> Option
         analysis_result = parse_llm_response(result_text)
         
         if analysis_result and analysis_result.get("is_concern"):
-            if supabase_client:
-                try:
-                    supabase_client.table('cache').upsert({
-                        'key': cache_key,
-                        'value': json.dumps(analysis_result)
-                    }).execute()
-                except Exception as e:
-                    logger.warning(f"⚠️ Cache save failed: {e}")
             return analysis_result
             
     except Exception as e:
@@ -319,69 +564,126 @@ async def analyze_chunk_for_concerns(llm: Groq, chunk: Dict[str, Any]) -> Option
     
     return None
 
+_THINK_RE = re.compile(r'<think>.*?</think>', re.DOTALL | re.IGNORECASE)
+# Reasoning blocks stripped from chat answers; the batch regex and the stream cleaner share these tags
+_CHAT_BLOCK_TAGS = ("think", "reasoning")
+_CHAT_BLOCK_RE = re.compile(rf'<({"|".join(_CHAT_BLOCK_TAGS)})>.*?</\1>', re.DOTALL | re.IGNORECASE)
+_TAG_RE = re.compile(r'<[^>]+>')
+_BLANK_LINES_RE = re.compile(r'\n\s*\n+')
+
+def _line_filter(phrases: Tuple[str, ...]) -> "re.Pattern[str]":
+    """Matches a whole line (and its newline) that contains any of the phrases, case-insensitively."""
+    return re.compile(r'^.*(?:' + '|'.join(map(re.escape, phrases)) + r').*(?:\n|$)', re.IGNORECASE | re.MULTILINE)
+
+_LLM_FILLER_LINE_RE = _line_filter((
+    "okay, so i need to analyze", "sure, i can help", "here is the analysis", "i have analyzed the text",
+))
+_CHAT_FILLER_LINE_RE = _line_filter((
+    "let me think", "i need to", "first,", "next,", "i should", "i will",
+    "okay,", "so,", "well,", "hmm,", "let me", "i'll", "i'm going to",
+))
+CATEGORIES = (
+    "EXCLUSION", "LIMITATION", "WAITING_PERIOD", "DEDUCTIBLE", 
+    "COPAYMENT", "COINSURANCE", "POLICYHOLDER_DUTY", 
+    "RENEWAL_RESTRICTION", "CLAIM_PROCESS", "NETWORK_RESTRICTION"
+)
+# Lower-cased phrase -> canonical value, checked in priority order
+CATEGORY_MAP = {cat.replace("_", " ").lower(): cat for cat in CATEGORIES}
+SEVERITY_MAP = {"high": "HIGH", "medium": "MEDIUM", "low": "LOW"}
+
+_FIELD_RE = re.compile(r"^(Is Concern|Category|Severity|Summary|Recommendation)\s*:\s*(.*)", re.IGNORECASE | re.MULTILINE)
+
 def clean_llm_response(response: str) -> str:
     """More aggressively clean LLM response artifacts."""
-    import re
-    
     # Remove XML-style thinking tags and their entire content
-    response = re.sub(r'<think>.*?</think>', '', response, flags=re.DOTALL | re.IGNORECASE)
+    response = _THINK_RE.sub('', response)
     
     # Remove any other XML-like tags
-    response = re.sub(r'<[^>]+>', '', response)
+    response = _TAG_RE.sub('', response)
     
     # Remove lines that are just conversational filler or metadata
-    lines = response.split('\n')
-    cleaned_lines = []
-    for line in lines:
-        line_lower = line.strip().lower()
-        if not any(phrase in line_lower for phrase in [
-            "okay, so i need to analyze", "sure, i can help", "here is the analysis", "i have analyzed the text"
-        ]):
-            cleaned_lines.append(line)
-            
-    response = '\n'.join(cleaned_lines)
+    response = _LLM_FILLER_LINE_RE.sub('', response)
     
     # Standardize whitespace
-    response = re.sub(r'\n\s*\n+', '\n', response.strip())
+    response = _BLANK_LINES_RE.sub('\n', response.strip())
     
     return response
 
 def clean_chat_response(response: str) -> str:
     """Clean chat responses to remove reasoning and improve formatting."""
-    import re
-    
     # Remove thinking/reasoning sections
-    response = re.sub(r'<think>.*?</think>', '', response, flags=re.DOTALL | re.IGNORECASE)
-    response = re.sub(r'<reasoning>.*?</reasoning>', '', response, flags=re.DOTALL | re.IGNORECASE)
+    response = _CHAT_BLOCK_RE.sub('', response)
     
-    # Remove lines that start with thinking indicators
-    lines = response.split('\n')
-    cleaned_lines = []
-    for line in lines:
-        line_lower = line.strip().lower()
-        # Skip lines that are clearly reasoning/thinking
-        if any(phrase in line_lower for phrase in [
-            "let me think", "i need to", "first,", "next,", "i should", "i will",
-            "okay,", "so,", "well,", "hmm,", "let me", "i'll", "i'm going to"
-        ]):
-            continue
-        # Skip empty lines
-        if not line.strip():
-            continue
-        cleaned_lines.append(line)
+    # Remove lines that are clearly reasoning/thinking
+    response = _CHAT_FILLER_LINE_RE.sub('', response)
     
-    # Join lines and clean up formatting
-    response = '\n'.join(cleaned_lines)
-    
-    # Remove excessive whitespace
-    response = re.sub(r'\n\s*\n+', '\n\n', response.strip())
+    # Drop empty lines
+    response = _BLANK_LINES_RE.sub('\n', response.strip())
     
     # If response is too short, return a simple message
     if len(response.strip()) < 10:
-        return "I don't have enough information to answer that question based on the current finding."
+        return CHAT_FALLBACK_ANSWER
     
     return response
 
+_BLOCK_OPEN_RE = re.compile(rf'<({"|".join(_CHAT_BLOCK_TAGS)})>', re.IGNORECASE)
+_BLOCK_CLOSE_RES = {name: re.compile(rf'</{name}>', re.IGNORECASE) for name in _CHAT_BLOCK_TAGS}
+CHAT_FALLBACK_ANSWER = "I don't have enough information to answer that question based on the current finding."
+
+class ChatStreamCleaner:
+    """Line-buffered counterpart of clean_chat_response for streamed completions."""
+
+    def __init__(self):
+        self._buffer = ""
+        self._open_block: Optional[str] = None
+        self._emitted = 0
+
+    def feed(self, delta: str) -> str:
+        """Accepts a token delta and returns cleaned text for any lines it completed."""
+        self._buffer += delta
+        *lines, self._buffer = self._buffer.split("\n")
+        return "".join(self._emit(line) for line in lines)
+
+    def flush(self) -> str:
+        """Cleans the trailing partial line; falls back to a stock answer if nothing useful came through."""
+        sent = self._emitted
+        out = self._emit(self._buffer)
+        self._buffer = ""
+        if self._emitted < 10:
+            # Whatever was already sent can't be retracted; replace only the unsent tail
+            out = ("\n" if sent else "") + CHAT_FALLBACK_ANSWER
+        return out
+
+    def _strip_blocks(self, line: str) -> str:
+        kept = []
+        while line:
+            if self._open_block:
+                m = _BLOCK_CLOSE_RES[self._open_block].search(line)
+                if not m:
+                    break
+                self._open_block = None
+                line = line[m.end():]
+            else:
+                m = _BLOCK_OPEN_RE.search(line)
+                if not m:
+                    kept.append(line)
+                    break
+                kept.append(line[:m.start()])
+                self._open_block = m.group(1).lower()
+                line = line[m.end():]
+        return "".join(kept)
+
+    def _emit(self, line: str) -> str:
+        line = self._strip_blocks(line)
+        if not line.strip() or _CHAT_FILLER_LINE_RE.search(line):
+            return ""
+        if self._emitted:
+            line = "\n" + line
+        else:
+            line = line.lstrip()
+        self._emitted += len(line)
+        return line
+
 def parse_llm_response(response: str) -> Optional[Dict[str, Any]]:
     """Parse structured LLM response into a dictionary."""
     try:
@@ -395,15 +697,12 @@ def parse_llm_response(response: str) -> Optional[Dict[str, Any]]:
             "recommendation": ""
         }
 
-        # Regex to find key-value pairs, ignoring case and whitespace
-        def get_value(key: str) -> Optional[str]:
-            import re
-            match = re.search(f"^{key}\\s*:\\s*(.*)", response, re.IGNORECASE | re.MULTILINE)
-            if match:
-                return match.group(1).strip().replace("[", "").replace("]", "")
-            return None
+        # Collect every "Key: value" line in one scan, keeping the first occurrence of each key
+        fields: Dict[str, str] = {}
+        for match in _FIELD_RE.finditer(response):
+            fields.setdefault(match.group(1).lower(), match.group(2).strip().replace("[", "").replace("]", ""))
 
-        is_concern_str = get_value("Is Concern")
+        is_concern_str = fields.get("is concern")
         if is_concern_str:
             result["is_concern"] = "true" in is_concern_str.lower()
 
@@ -411,30 +710,23 @@ def parse_llm_response(response: str) -> Optional[Dict[str, Any]]:
         if not result["is_concern"]:
             return result
 
-        category_str = get_value("Category")
+        category_str = fields.get("category")
         if category_str:
-            categories = [
-                "EXCLUSION", "LIMITATION", "WAITING_PERIOD", "DEDUCTIBLE", 
-                "COPAYMENT", "COINSURANCE", "POLICYHOLDER_DUTY", 
-                "RENEWAL_RESTRICTION", "CLAIM_PROCESS", "NETWORK_RESTRICTION"
-            ]
-            for cat in categories:
-                if cat.replace("_", " ").lower() in category_str.lower():
-                    result["category"] = cat
-                    break
+            category_lower = category_str.lower()
+            result["category"] = next(
+                (cat for phrase, cat in CATEGORY_MAP.items() if phrase in category_lower), result["category"])
         
-        severity_str = get_value("Severity")
+        severity_str = fields.get("severity")
         if severity_str:
             severity_lower = severity_str.lower()
-            if "high" in severity_lower: result["severity"] = "HIGH"
-            elif "medium" in severity_lower: result["severity"] = "MEDIUM"
-            elif "low" in severity_lower: result["severity"] = "LOW"
+            result["severity"] = next(
+                (level for word, level in SEVERITY_MAP.items() if word in severity_lower), result["severity"])
 
-        summary_str = get_value("Summary")
+        summary_str = fields.get("summary")
         if summary_str:
             result["summary"] = summary_str
 
-        recommendation_str = get_value("Recommendation")
+        recommendation_str = fields.get("recommendation")
         if recommendation_str:
             result["recommendation"] = recommendation_str
 
@@ -459,39 +751,179 @@ def parse_llm_response(response: str) -> Optional[Dict[str, Any]]:
 # - analysis_status TEXT
 # - analysis_completed_at TIMESTAMP WITH TIME ZONE
 # - upload_date TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+# JSON columns are JSONB and are written as native values (no json.dumps):
+# - findings.coordinates JSONB
+# - cache.key TEXT PRIMARY KEY, cache.value JSONB
+#   Migrating from TEXT columns:
+#     ALTER TABLE cache ALTER COLUMN value TYPE JSONB USING value::jsonb;
+#     ALTER TABLE findings ALTER COLUMN coordinates TYPE JSONB USING coordinates::jsonb;
+# Findings are deduplicated server-side by this function (called via RPC from get_findings).
+# It returns only the Finding response columns so text_content/coordinates never cross the wire
+# (DROP FUNCTION IF EXISTS distinct_findings(TEXT) first if an older SETOF findings version exists):
+#   CREATE OR REPLACE FUNCTION distinct_findings(doc_id TEXT)
+#   RETURNS TABLE(id BIGINT, category TEXT, severity TEXT, summary TEXT, recommendation TEXT,
+#                 page_num INTEGER, confidence_score DOUBLE PRECISION)
+#   LANGUAGE sql STABLE AS $$
+#     SELECT f.id::BIGINT, f.category::TEXT, f.severity::TEXT, f.summary::TEXT, f.recommendation::TEXT,
+#            f.page_num::INTEGER, f.confidence_score::DOUBLE PRECISION
+#     FROM (
+#       SELECT DISTINCT ON (summary) * FROM findings
+#       WHERE document_id = doc_id ORDER BY summary, severity, page_num
+#     ) f ORDER BY f.severity, f.page_num;
+#   $$;
+# Indexes for the hot reads (PDF filename, /progress status, per-document findings):
+#   CREATE INDEX CONCURRENTLY idx_documents_id_status ON documents (id) INCLUDE (analysis_status, filename);
+#   CREATE INDEX CONCURRENTLY idx_findings_document_id ON findings (document_id, severity, page_num);
+#   findings.id lookups use the primary key; text_content is deliberately not INCLUDEd since
+#   chunk-sized text can exceed the btree tuple size limit.
+
+# Read-through caches for hot polling paths; writers below pop entries on change
+FILENAME_CACHE_TTL = 300
+PROGRESS_CACHE_TTL = 2
+filename_cache: TTLCache = TTLCache(maxsize=10_000, ttl=FILENAME_CACHE_TTL)
+progress_cache: TTLCache = TTLCache(maxsize=10_000, ttl=PROGRESS_CACHE_TTL)
+
+def invalidate_document_cache(document_id: str):
+    filename_cache.pop(document_id, None)
+    progress_cache.pop(document_id, None)
+
+async def get_filename(document_id: str) -> Optional[str]:
+    """Returns the stored filename for a document, querying Supabase only on a cache miss."""
+    if document_id in filename_cache:
+        return filename_cache[document_id]
+    rows = await _rest_get('documents', {'select': 'filename', 'id': f"eq.{document_id}"})
+    if not rows:
+        return None
+    filename = filename_cache[document_id] = rows[0]['filename']
+    return filename
+
+class StatusLoader:
+    """Coalesces status lookups arriving within a short window into one `in_` query."""
+
+    def __init__(self, window: float = 0.01, max_batch: int = IN_FILTER_BATCH_SIZE):
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushes: Set[asyncio.Task] = set()
+
+    async def load(self, document_id: str) -> Optional[str]:
+        future = self._pending.get(document_id)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._pending[document_id] = loop.create_future()
+            if len(self._pending) >= self.max_batch:
+                self._dispatch()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.window, self._dispatch)
+        # Shield so one cancelled poll doesn't cancel the shared result for the others
+        return await asyncio.shield(future)
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        task = asyncio.create_task(self._flush(batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch: Dict[str, asyncio.Future]):
+        try:
+            rows = await _rest_get('documents', {'select': 'id,analysis_status', 'id': _in_filter(list(batch))})
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        statuses = {row['id']: row['analysis_status'] for row in rows}
+        for document_id, future in batch.items():
+            if not future.done():
+                future.set_result(statuses.get(document_id))
+
+progress_loader = StatusLoader()
+
+async def get_cached_analysis_status(document_id: str) -> Optional[str]:
+    """Returns the document's analysis status, cached briefly to absorb frontend polling."""
+    if document_id in progress_cache:
+        return progress_cache[document_id]
+    status = await progress_loader.load(document_id)
+    if status is not None:
+        progress_cache[document_id] = status
+    return status
 
 async def save_document_metadata(doc_id: str, filename: str, page_count: int):
+    """Creates the document row, or resets it to 'pending' when the same PDF is re-ingested."""
     if not supabase_client: return
     try:
-        supabase_client.table('documents').insert({
+        await _db(supabase_client.table('documents').upsert({
             'id': doc_id,
             'filename': filename,
             'total_pages': page_count,
             'analysis_status': 'pending',
-        }).execute()
+        }, on_conflict='id').execute)
+        invalidate_document_cache(doc_id)
     except Exception as e:
         logger.error(f"❌ DB Error saving document metadata for {doc_id}: {e}")
 
+def _finding_row(document_id: str, finding: Dict[str, Any], chunk: Dict[str, Any]) -> Dict[str, Any]:
+    """Maps an analysis result and its chunk to a 'findings' table row."""
+    return {
+        'document_id': document_id,
+        'page_num': chunk.get('page_num', 0),
+        'coordinates': chunk.get('coordinates', []),
+        'text_content': chunk.get('text', ''),
+        'category': finding.get('category', 'UNCATEGORIZED'),
+        'severity': finding.get('severity', 'UNKNOWN'),
+        'summary': finding.get('summary', 'No summary provided.'),
+        'recommendation': finding.get('recommendation', ''),
+        # Calculate confidence score based on finding quality
+        'confidence_score': calculate_confidence_score(finding),
+    }
+
 async def save_finding(document_id: str, finding: Dict[str, Any], chunk: Dict[str, Any]):
     if not supabase_client: return
     try:
-        # Calculate confidence score based on finding quality
-        confidence_score = calculate_confidence_score(finding)
-        
-        supabase_client.table('findings').insert({
-            'document_id': document_id,
-            'page_num': chunk.get('page_num', 0),
-            'coordinates': json.dumps(chunk.get('coordinates', [])),
-            'text_content': chunk.get('text', ''),
-            'category': finding.get('category', 'UNCATEGORIZED'),
-            'severity': finding.get('severity', 'UNKNOWN'),
-            'summary': finding.get('summary', 'No summary provided.'),
-            'recommendation': finding.get('recommendation', ''),
-            'confidence_score': confidence_score,
-        }).execute()
+        await _db(supabase_client.table('findings').insert(_finding_row(document_id, finding, chunk)).execute)
     except Exception as e:
         logger.error(f"❌ DB Error saving finding for doc {document_id}: {e}")
 
+async def save_findings(document_id: str, rows: List[Dict[str, Any]]):
+    """Inserts many finding rows in a single multi-row request."""
+    if not supabase_client or not rows: return
+    try:
+        await _db(supabase_client.table('findings').insert(rows).execute)
+    except Exception as e:
+        logger.error(f"❌ DB Error saving {len(rows)} findings for doc {document_id}: {e}")
+
+_distinct_findings_rpc_available = True
+# PostgREST's "function not found" codes (schema cache miss / undefined_function)
+_RPC_MISSING_CODES = {'PGRST202', '42883'}
+
+async def fetch_distinct_findings(document_id: str) -> List[Dict[str, Any]]:
+    """Returns one finding per summary, ordered by severity then page, deduplicated in Postgres."""
+    global _distinct_findings_rpc_available
+    if _distinct_findings_rpc_available:
+        try:
+            response = await _db(supabase_client.rpc('distinct_findings', {'doc_id': document_id}).execute)
+            return response.data
+        except APIError as e:
+            if e.code in _RPC_MISSING_CODES:
+                # Function not deployed yet: stop trying and dedupe client-side from now on
+                logger.warning(f"⚠️ distinct_findings RPC not deployed, deduplicating in Python: {e.message}")
+                _distinct_findings_rpc_available = False
+            else:
+                logger.warning(f"⚠️ distinct_findings RPC error {e.code}, deduplicating in Python for this request: {e.message}")
+        except Exception as e:
+            # Transient failure: fall back for this request only and keep using the RPC
+            logger.warning(f"⚠️ distinct_findings RPC failed, deduplicating in Python for this request: {e}")
+
+    response = await _db(supabase_client.table('findings').select(FINDING_COLUMNS).eq('document_id', document_id).order('severity').order('page_num').execute)
+    unique_rows = {}
+    for row in response.data:
+        unique_rows.setdefault(row['summary'], row)
+    return list(unique_rows.values())
+
 def calculate_confidence_score(finding: Dict[str, Any]) -> float:
     """Calculate confidence score based on finding quality."""
     score = 0.5  # Base score
@@ -523,36 +955,68 @@ async def update_analysis_status(document_id: str, status: str):
         if status == 'completed':
             update_data['analysis_completed_at'] = datetime.now().isoformat()
         
-        supabase_client.table('documents').update(update_data).eq('id', document_id).execute()
+        await _db(supabase_client.table('documents').update(update_data).eq('id', document_id).execute)
+        progress_cache.pop(document_id, None)
         logger.info(f"✅ Analysis status for {document_id} updated to '{status}'.")
     except Exception as e:
         logger.error(f"❌ DB Error updating status for doc {document_id}: {e}")
 
+PINECONE_INDEX_NAME = "insurance-doc"
+PINECONE_UPSERT_BATCH_SIZE = 100
+PINECONE_POOL_THREADS = 4
+# The existing index is 512-d; set PINECONE_INDEX_DIM=768 after recreating it at the model's native size
+PINECONE_INDEX_DIM = int(os.getenv("PINECONE_INDEX_DIM", "512"))
+
+@lru_cache(maxsize=4)
+def _projection_matrix(source_dim: int, target_dim: int) -> np.ndarray:
+    """Fixed-seed Gaussian random projection; preserves cosine geometry far better than truncation."""
+    return np.random.default_rng(0).standard_normal((source_dim, target_dim)).astype(np.float32)
+
+def _fit_to_index_dim(embeddings: List[List[float]]) -> np.ndarray:
+    """Projects a batch of embeddings to the Pinecone index dimension with a single matmul."""
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    if matrix.shape[1] == PINECONE_INDEX_DIM:
+        return matrix
+    return matrix @ _projection_matrix(matrix.shape[1], PINECONE_INDEX_DIM)
+
+async def _get_pinecone_index():
+    global pinecone_index
+    if pinecone_index is None:
+        # Resolving the index host is a blocking HTTP call; a concurrent duplicate is simply dropped unused
+        index = await asyncio.to_thread(pc.Index, PINECONE_INDEX_NAME, pool_threads=PINECONE_POOL_THREADS)
+        if pinecone_index is None:
+            pinecone_index = index
+    return pinecone_index
+
 async def add_to_vectorstore(namespace: str, chunks: List[Dict[str, Any]]):
-    if not pc: return
+    if not pc or not chunks: return
     try:
         texts = [chunk['text'] for chunk in chunks]
-        embeddings = await get_embeddings_huggingface(texts)
-        
-        index = pc.Index("insurance-doc")
-        # Ensure embedding dimension matches index (512)
-        vectors = []
-        for chunk, emb in zip(chunks, embeddings):
-            if len(emb) != 512:
-                emb = emb[:512] if len(emb) > 512 else (emb + [0.0]*(512-len(emb)))
-            vectors.append({
-                'id': f"{namespace}_{chunk['id']}",
-                'values': emb,
-                'metadata': {'text': chunk['text'], 'namespace': namespace}
-            })
+        token_counts = [chunk['token_count'] for chunk in chunks]
+        embeddings = _fit_to_index_dim(await get_embeddings_huggingface(texts, token_counts))
+        
+        index = await _get_pinecone_index()
+        vectors = [{
+            'id': f"{namespace}_{chunk['id']}",
+            'values': emb.tolist(),
+            # Keep metadata small: the chunk text is rebuilt from the document's cached blocks
+            'metadata': {'chunk_id': chunk['id'], 'page_num': chunk['page_num']}
+        } for chunk, emb in zip(chunks, embeddings)]
         
-        index.upsert(vectors=vectors)
-        logger.info(f"✅ Added {len(vectors)} vectors to Pinecone.")
+        # Upsert in 100-vector batches in parallel; the document is the namespace
+        batches = [vectors[i:i + PINECONE_UPSERT_BATCH_SIZE]
+                   for i in range(0, len(vectors), PINECONE_UPSERT_BATCH_SIZE)]
+        futures = [index.upsert(vectors=batch, namespace=namespace, async_req=True) for batch in batches]
+        await asyncio.to_thread(lambda: [future.get() for future in futures])
+        logger.info(f"✅ Added {len(vectors)} vectors to Pinecone in {len(batches)} batches.")
     except Exception as e:
         logger.error(f"❌ Failed to add to vector store: {e}")
 
 # --- Main Background Task ---
 
+# The event loop only keeps weak references to tasks; hold fire-and-forget ones until they finish
+_background_tasks: Set["asyncio.Task[None]"] = set()
+
 async def analyze_document_background(document_id: str):
     """The main background task to process and analyze a document."""
     logger.info(f"🔄 Starting full analysis for document: {document_id}")
@@ -564,35 +1028,55 @@ async def analyze_document_background(document_id: str):
 
     try:
         # Get cached data
-        blocks_response = supabase_client.table('cache').select('value').eq('key', f"blocks:{document_id}").execute()
+        blocks_response = await _db(supabase_client.table('cache').select('value').eq('key', f"blocks:{document_id}").execute)
         if not blocks_response.data:
             logger.error(f"❌ Text blocks not found in cache for {document_id}.")
             await update_analysis_status(document_id, 'failed')
             return
         
-        text_blocks = json.loads(blocks_response.data[0]['value'])
+        text_blocks = _load_cache_value(blocks_response.data[0]['value'])
         chunks = await chunk_text_with_coordinates(text_blocks)
         
         # Add to vector store in parallel
-        asyncio.create_task(add_to_vectorstore(document_id, chunks))
+        vector_task = asyncio.create_task(add_to_vectorstore(document_id, chunks))
+        _background_tasks.add(vector_task)
+        vector_task.add_done_callback(_background_tasks.discard)
 
         llm = get_llm_client()
         if not llm:
             await update_analysis_status(document_id, 'failed')
             return
             
-        # Analyze chunks
-        analysis_tasks = [analyze_chunk_for_concerns(llm, chunk) for chunk in chunks]
-        results = await asyncio.gather(*analysis_tasks)
-
-        # Save valid findings
-        findings_count = 0
-        for i, finding in enumerate(results):
-            if finding and finding.get('is_concern'):
-                await save_finding(document_id, finding, chunks[i])
-                findings_count += 1
-        
-        logger.info(f"✅ Analysis complete for {document_id}. Found {findings_count} concerns.")
+        # Repeated boilerplate chunks share a key, so each distinct text is analyzed once
+        cache_keys = [_analysis_cache_key(chunk['text']) for chunk in chunks]
+        chunk_by_key: Dict[str, Dict[str, Any]] = {}
+        for key, chunk in zip(cache_keys, chunks):
+            chunk_by_key.setdefault(key, chunk)
+
+        # Look up cached analyses in one round-trip, then analyze the misses
+        cached = await get_cached_values(list(chunk_by_key))
+        analysis_tasks = [analyze_chunk_for_concerns(llm, chunk, cached.get(key))
+                          for key, chunk in chunk_by_key.items()]
+        analyses = dict(zip(chunk_by_key, await asyncio.gather(*analysis_tasks)))
+        if len(analyses) < len(chunks):
+            logger.info(f"♻️ Reusing analyses for {len(chunks) - len(analyses)} duplicate chunks.")
+
+        # Cache new concerns
+        await save_cached_values({
+            key: finding for key, finding in analyses.items()
+            if finding and finding.get('is_concern') and key not in cached
+        })
+
+        # Fan each result back out to every chunk that shares its text
+        results = [analyses[key] for key in cache_keys]
+
+        # Save valid findings in one insert
+        rows = [_finding_row(document_id, finding, chunk)
+                for finding, chunk in zip(results, chunks)
+                if finding and finding.get('is_concern')]
+        await save_findings(document_id, rows)
+        
+        logger.info(f"✅ Analysis complete for {document_id}. Found {len(rows)} concerns.")
         await update_analysis_status(document_id, 'completed')
 
     except Exception as e:
@@ -602,6 +1086,44 @@ async def analyze_document_background(document_id: str):
 # --- FastAPI App Setup ---
 
 app = FastAPI(title="Insurance Document Analysis API", version="3.4.0")
+
+# Vercel serverless functions have 4.5MB request body limit
+MAX_UPLOAD_BYTES = int(4.4 * 1024 * 1024)  # 4.4MB to be safe
+
+def validate_upload_size(content_length: Union[str, int, None], max_bytes: int) -> bool:
+    """False only when the declared size is known to exceed max_bytes; unknown sizes are checked while streaming."""
+    try:
+        return int(content_length) <= max_bytes
+    except (TypeError, ValueError):
+        return True
+
+# Headroom for the multipart boundary and part headers around the file itself
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+class UploadSizeLimitMiddleware:
+    """Pure ASGI check that refuses oversized /ingest bodies by Content-Length before they are read.
+
+    Every other request passes straight through; chunked uploads are still checked in the handler.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] == "/ingest":
+            content_length = next((v.decode("latin-1") for k, v in scope["headers"] if k == b"content-length"), None)
+            if not validate_upload_size(content_length, MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES):
+                logger.warning(f"⚠️ Rejected upload with Content-Length {content_length} before reading the body.")
+                response = JSONResponse(
+                    {"detail": f"File too large. Maximum size is {MAX_UPLOAD_BYTES // (1024*1024)}MB."},
+                    status_code=413,
+                )
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+app.add_middleware(UploadSizeLimitMiddleware)
+# Added after the size check so CORS stays outermost and 413s remain readable cross-origin
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"], # Best to restrict in production
@@ -612,6 +1134,34 @@ app.add_middleware(
 # Static files mounting disabled for Vercel deployment
 # app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 
+@app.on_event("shutdown")
+async def close_http_client():
+    await http_client.aclose()
+    if pgrest:
+        await pgrest.aclose()
+    if llm_client:
+        await llm_client.close()
+
+@app.on_event("shutdown")
+async def shutdown_executors():
+    if _pdf_executor is not None:
+        _pdf_executor.shutdown(wait=False, cancel_futures=True)
+    _db_executor.shutdown(wait=False, cancel_futures=True)
+
+# Response timestamps are formatted at most every CLOCK_REFRESH_SECONDS and reused in between.
+# Refreshed on read rather than by a background task, since serverless runtimes skip lifespan events.
+CLOCK_REFRESH_SECONDS = 0.5
+_now_iso = datetime.now(timezone.utc).isoformat()
+_now_iso_at = time.monotonic()
+
+def now_iso() -> str:
+    global _now_iso, _now_iso_at
+    now = time.monotonic()
+    if now - _now_iso_at > CLOCK_REFRESH_SECONDS:
+        _now_iso = datetime.now(timezone.utc).isoformat()
+        _now_iso_at = now
+    return _now_iso
+
 # --- Pydantic Models ---
 
 class IngestResponse(BaseModel):
@@ -634,8 +1184,30 @@ class Finding(BaseModel):
     page_num: int
     confidence_score: float
 
+FINDING_COLUMNS = ",".join(Finding.model_fields)
+
 # --- API Endpoints ---
 
+PDF_CHUNK_SIZE = int(os.getenv("PDF_CHUNK_SIZE", str(1 << 20)))
+PDF_CACHE_CONTROL = "private, max-age=3600"
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against a strong ETag, as RFC 9110 requires for GET."""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(tag.removeprefix("W/") == etag for tag in candidates)
+
+class PDFResponse(FileResponse):
+    """FileResponse that streams in PDF_CHUNK_SIZE reads instead of Starlette's 64KB default."""
+    chunk_size = PDF_CHUNK_SIZE
+
+def _upload_too_large(size: int) -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"File too large. Maximum size is {MAX_UPLOAD_BYTES // (1024*1024)}MB. Your file is {size // (1024*1024)}MB."
+    )
+
 @app.get("/")
 async def root():
     return {"message": "Insurance Document Analysis API is running."}
@@ -644,54 +1216,65 @@ async def root():
 async def ingest(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
     logger.info(f"📤 Ingest request received for file: {file.filename} ({file.size} bytes)")
     try:
-        # Vercel serverless functions have 4.5MB request body limit
-        MAX_FILE_SIZE = 4.4 * 1024 * 1024  # 4.4MB to be safe
-        
-        pdf_bytes = await file.read()
-        if not pdf_bytes:
-            raise HTTPException(400, "Empty file received.")
-        
-        # Check file size before processing
-        if len(pdf_bytes) > MAX_FILE_SIZE:
-            raise HTTPException(
-                status_code=413, 
-                detail=f"File too large. Maximum size is {MAX_FILE_SIZE // (1024*1024)}MB. Your file is {len(pdf_bytes) // (1024*1024)}MB."
-            )
+        # Reject declared oversize uploads before copying anything to disk
+        if not validate_upload_size(file.size, MAX_UPLOAD_BYTES):
+            raise _upload_too_large(file.size)
         
-        doc_id = hashlib.sha256(pdf_bytes).hexdigest()
+        # Stream the upload to disk in 1MB chunks, hashing in the same pass
+        hasher = hashlib.sha256()
+        size = 0
+        tmp_path = UPLOADS_DIR / f".upload-{uuid.uuid4().hex}.part"
+        try:
+            with open(tmp_path, "wb") as out:
+                while True:
+                    chunk = await file.read(1 << 20)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if not validate_upload_size(size, MAX_UPLOAD_BYTES):
+                        break
+                    hasher.update(chunk)
+                    await asyncio.to_thread(out.write, chunk)
+
+            if not size:
+                raise HTTPException(400, "Empty file received.")
+            
+            # Check file size before processing
+            if not validate_upload_size(size, MAX_UPLOAD_BYTES):
+                raise _upload_too_large(size)
+            
+            doc_id = hasher.hexdigest()
+            # Content-addressed name, so replacing an existing copy is harmless
+            pdf_path = UPLOADS_DIR / f"{doc_id}.pdf"
+            os.replace(tmp_path, pdf_path)
+            logger.info(f"✅ PDF saved to: {pdf_path}")
+        finally:
+            tmp_path.unlink(missing_ok=True)
         
-        # CORRECTED: Allow re-analysis by deleting old data first.
-        if supabase_client:
-            existing = supabase_client.table('documents').select('id').eq('id', doc_id).execute()
-            if existing.data:
-                logger.warning(f"⚠️ Document {doc_id} already exists. Deleting old data to re-analyze.")
-                # Delete old findings before starting new analysis
-                supabase_client.table('findings').delete().eq('document_id', doc_id).execute()
-                # We can keep the document entry and just update it
-                supabase_client.table('documents').update({'analysis_status': 'pending'}).eq('id', doc_id).execute()
-            else:
-                 # If it doesn't exist, save new metadata
-                text_blocks_temp = await extract_text_with_coordinates(pdf_bytes)
-                page_count_temp = max(b['page_num'] for b in text_blocks_temp) if text_blocks_temp else 0
-                await save_document_metadata(doc_id, file.filename, page_count_temp)
-
+        # Extract once; the page count and block cache both reuse this result
+        text_blocks = await extract_text_with_coordinates(str(pdf_path))
+        page_count = max(text_blocks["page"], default=0)
 
-        # Save PDF to local storage for serving
-        pdf_path = UPLOADS_DIR / f"{doc_id}.pdf"
-        with open(pdf_path, "wb") as f:
-            f.write(pdf_bytes)
-        logger.info(f"✅ PDF saved to: {pdf_path}")
-        
-        text_blocks = await extract_text_with_coordinates(pdf_bytes)
-        page_count = max(b['page_num'] for b in text_blocks) if text_blocks else 0
+        # Allow re-analysis: upsert the document row and look up old finding ids concurrently.
+        # Only ids are fetched (for cache invalidation and the log); the delete returns nothing.
+        if supabase_client:
+            _, old_findings = await asyncio.gather(
+                save_document_metadata(doc_id, file.filename, page_count),
+                _db(supabase_client.table('findings').select('id').eq('document_id', doc_id).execute),
+            )
+            if old_findings.data:
+                await _db(supabase_client.table('findings').delete(returning=ReturnMethod.minimal).eq('document_id', doc_id).execute)
+                for row in old_findings.data:
+                    finding_cache.pop(row['id'], None)
+                logger.warning(f"⚠️ Document {doc_id} already existed. Cleared {len(old_findings.data)} old findings to re-analyze.")
 
         # Cache text blocks for the background worker
         if supabase_client:
             try:
-                supabase_client.table('cache').upsert({
+                await _db(supabase_client.table('cache').upsert({
                     'key': f"blocks:{doc_id}",
-                    'value': json.dumps(text_blocks)
-                }).execute()
+                    'value': text_blocks
+                }).execute)
             except Exception as e:
                 logger.warning(f"⚠️ Failed to cache text blocks for {doc_id}: {e}")
         
@@ -703,6 +1286,8 @@ async def ingest(background_tasks: BackgroundTasks, file: UploadFile = File(...)
             total_pages=page_count,
             analysis_status="pending"
         )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"❌ Ingestion error: {e}")
         raise HTTPException(500, "An unexpected error occurred during file ingestion.")
@@ -712,13 +1297,13 @@ async def get_analysis_status(document_id: str):
     if not supabase_client:
         raise HTTPException(503, "Database service is not available.")
     try:
-        doc_response = supabase_client.table('documents').select('analysis_status').eq('id', document_id).execute()
+        doc_response = await _db(supabase_client.table('documents').select('analysis_status').eq('id', document_id).execute)
         if not doc_response.data:
             raise HTTPException(404, "Document not found.")
         
         status = doc_response.data[0]['analysis_status']
         
-        count_response = supabase_client.table('findings').select('id', count='exact').eq('document_id', document_id).execute()
+        count_response = await _db(supabase_client.table('findings').select('id', count='exact').eq('document_id', document_id).execute)
         findings_count = count_response.count or 0
         
         return AnalysisStatus(
@@ -735,47 +1320,49 @@ async def get_findings(document_id: str):
     if not supabase_client:
         raise HTTPException(503, "Database service is not available.")
     try:
-        response = supabase_client.table('findings').select('*').eq('document_id', document_id).order('severity').order('page_num').execute()
-        
-        # Deduplicate findings based on summary
-        unique_findings = {}
-        for row in response.data:
-            summary = row['summary']
-            if summary not in unique_findings:
-                 unique_findings[summary] = Finding(**row)
-
-        return list(unique_findings.values())
+        rows = await fetch_distinct_findings(document_id)
+        # Rows come from our own table, so skip validation
+        return [Finding.model_construct(**row) for row in rows]
     except Exception as e:
         logger.error(f"❌ Failed to get findings for {document_id}: {e}")
         return []
 
 @app.get("/documents/{document_id}/pdf")
-async def get_pdf(document_id: str):
+async def get_pdf(document_id: str, request: Request):
     """Serve PDF file for document viewer."""
     logger.info(f"📄 PDF request for document: {document_id}")
     
+    # Document ids are the SHA-256 of the PDF bytes, so the id itself is a strong validator
+    etag = f'"{document_id}"'
+    cache_headers = {"ETag": etag, "Cache-Control": PDF_CACHE_CONTROL}
+    
     try:
-        # Check if PDF file exists locally
+        # Stat once: doubles as the existence check and is reused for the response headers
         pdf_path = UPLOADS_DIR / f"{document_id}.pdf"
-        if not pdf_path.exists():
+        try:
+            pdf_stat = os.stat(pdf_path)
+        except FileNotFoundError:
             raise HTTPException(404, "PDF file not found.")
         
+        # Only a representation that exists can match (RFC 9110 §13.1.2), so this comes after the stat
+        if _etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=cache_headers)
+        
         # Get document metadata for filename
         filename = document_id
         if supabase_client:
             try:
-                doc_response = supabase_client.table('documents').select('filename').eq('id', document_id).execute()
-                if doc_response.data:
-                    filename = doc_response.data[0]['filename']
+                filename = await get_filename(document_id) or document_id
             except Exception as e:
                 logger.warning(f"⚠️ Could not get filename from database: {e}")
         
         # Serve the PDF file for inline viewing
-        return FileResponse(
+        return PDFResponse(
             path=pdf_path,
             filename=filename,
+            stat_result=pdf_stat,
             media_type="application/pdf",
-            headers={"Content-Disposition": "inline"}
+            headers={"Content-Disposition": "inline", **cache_headers}
         )
         
     except HTTPException:
@@ -784,6 +1371,22 @@ async def get_pdf(document_id: str):
         logger.error(f"❌ PDF serving error for {document_id}: {e}")
         raise HTTPException(500, "Failed to serve PDF.")
 
+class AnalysisStatusCode(IntEnum):
+    """Numeric form of documents.analysis_status, reported alongside the string."""
+    PENDING = 0
+    ANALYZING = 1
+    COMPLETED = 2
+    FAILED = 3
+
+# analysis_status -> (code, percent, message), resolved with a single lookup per poll
+STATUS_MAP: Dict[str, Tuple[AnalysisStatusCode, int, str]] = {
+    'pending': (AnalysisStatusCode.PENDING, 10, 'Waiting for analysis to start'),
+    'analyzing': (AnalysisStatusCode.ANALYZING, 60, 'AI is analyzing the document'),
+    'completed': (AnalysisStatusCode.COMPLETED, 100, 'Analysis completed'),
+    'failed': (AnalysisStatusCode.FAILED, 0, 'Analysis failed'),
+}
+STATUS_DEFAULT = (None, 0, 'Unknown status')
+
 @app.get("/progress/{document_id}")
 async def get_processing_progress(document_id: str):
     """Return simple progress information for the frontend polling UI."""
@@ -791,30 +1394,18 @@ async def get_processing_progress(document_id: str):
         return {"status": "error", "progress": 0, "message": "Database not configured"}
 
     try:
-        resp = supabase_client.table('documents').select('analysis_status').eq('id', document_id).execute()
-        if not resp.data:
+        status = await get_cached_analysis_status(document_id)
+        if status is None:
             return {"status": "not_found", "progress": 0, "message": "Document not found"}
 
-        status = resp.data[0]['analysis_status']
-        percent = {
-            'pending': 10,
-            'analyzing': 60,
-            'completed': 100,
-            'failed': 0
-        }.get(status, 0)
-
-        message = {
-            'pending': 'Waiting for analysis to start',
-            'analyzing': 'AI is analyzing the document',
-            'completed': 'Analysis completed',
-            'failed': 'Analysis failed'
-        }.get(status, 'Unknown status')
+        code, percent, message = STATUS_MAP.get(status, STATUS_DEFAULT)
 
         return {
             'status': status,
+            'status_code': code,
             'progress': percent,
             'message': message,
-            'timestamp': datetime.now().isoformat()
+            'timestamp': now_iso()
         }
     except Exception as e:
         logger.error(f"❌ Progress endpoint error: {e}")
@@ -825,7 +1416,7 @@ async def health_check():
     logger.info("🔍 Health check requested")
     return {
         "status": "healthy",
-        "timestamp": datetime.now().isoformat(),
+        "timestamp": now_iso(),
         "services": {
             "groq": GROQ_API_KEY is not None,
             "pinecone": pc is not None,
@@ -836,9 +1427,84 @@ async def health_check():
 
 # --- Chat Endpoint ---
 
+CHAT_PROMPT = """
+        You are an expert insurance policy analyst. Answer the user's question about this specific finding.
+        
+        IMPORTANT: Provide ONLY a direct, helpful answer. 
+        Do NOT include any reasoning, thinking process, or meta-commentary. 
+        Give a clear, concise response that directly addresses the user's question.
+        
+        Context:
+        - Text Content: {text_content}
+        - Finding: {summary}
+        - Category: {category}
+        - Severity: {severity}
+        - Recommendation: {recommendation}
+        
+        Question: {q}
+        
+        Answer the question directly and helpfully, using the context provided.
+        """
+
+class FindingContext(NamedTuple):
+    """The finding columns the chat prompt needs."""
+    text_content: str
+    summary: str
+    category: str
+    severity: str
+    recommendation: str
+
+FINDING_CONTEXT_COLUMNS = ",".join(FindingContext._fields)
+
+# Findings are immutable once written; re-ingest evicts the old ids and the TTL bounds
+# anything a concurrent fetch puts back after that
+FINDING_CACHE_TTL = 300
+finding_cache: TTLCache = TTLCache(maxsize=5_000, ttl=FINDING_CACHE_TTL)
+_finding_fetches: Dict[int, asyncio.Task] = {}
+
+async def _fetch_finding(finding_id: int) -> Optional[FindingContext]:
+    try:
+        rows = await _rest_get('findings', {'select': FINDING_CONTEXT_COLUMNS, 'id': f"eq.{finding_id}"})
+        if not rows:
+            return None
+        finding = finding_cache[finding_id] = FindingContext(**rows[0])
+        return finding
+    finally:
+        _finding_fetches.pop(finding_id, None)
+
+async def get_finding(finding_id: int) -> Optional[FindingContext]:
+    """Returns a finding's chat context; concurrent misses for the same id share one fetch."""
+    finding = finding_cache.get(finding_id)
+    if finding is not None:
+        return finding
+    fetch = _finding_fetches.get(finding_id)
+    if fetch is None:
+        fetch = _finding_fetches[finding_id] = asyncio.create_task(_fetch_finding(finding_id))
+    # Shield so one cancelled request doesn't cancel the shared fetch for the others
+    return await asyncio.shield(fetch)
+
+def _sse(payload: Dict[str, Any]) -> bytes:
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+async def _stream_chat_events(completion, finding_id: int, context: Dict[str, Any]):
+    """Relays cleaned answer deltas as SSE, ending with a 'done' event that carries the finding context."""
+    cleaner = ChatStreamCleaner()
+    try:
+        async for chunk in completion:
+            delta = cleaner.feed(chunk.choices[0].delta.content or "") if chunk.choices else ""
+            if delta:
+                yield _sse({"delta": delta})
+        tail = cleaner.flush()
+        if tail:
+            yield _sse({"delta": tail})
+        yield _sse({"done": True, "finding_id": finding_id, "context": context})
+    except Exception as e:
+        logger.error(f"❌ Chat stream error for finding {finding_id}: {e}")
+        yield _sse({"error": "Chat failed"})
+
 @app.post("/findings/{finding_id}/chat")
-async def contextual_chat(finding_id: int, request: Dict[str, str]):
-    """Contextual chat about specific finding"""
+async def contextual_chat(finding_id: int, request: Dict[str, str], stream: bool = False):
+    """Contextual chat about specific finding. With ?stream=true the answer is sent as server-sent events."""
     llm = get_llm_client()
     if not llm:
         raise HTTPException(500, "Chat service not available")
@@ -848,39 +1514,33 @@ async def contextual_chat(finding_id: int, request: Dict[str, str]):
         if not supabase_client:
             raise HTTPException(500, "Database not configured")
             
-        resp = supabase_client.table('findings').select('*').eq('id', finding_id).execute()
-        if not resp.data:
+        finding = await get_finding(finding_id)
+        if finding is None:
             raise HTTPException(404, "Finding not found")
         
-        finding = resp.data[0]
-        
-        prompt = f"""
-        You are an expert insurance policy analyst. Answer the user's question about this specific finding.
+        prompt = CHAT_PROMPT.format(q=request.get('q', ''), **finding._asdict())
         
-        IMPORTANT: Provide ONLY a direct, helpful answer. 
-        Do NOT include any reasoning, thinking process, or meta-commentary. 
-        Give a clear, concise response that directly addresses the user's question.
-        
-        Context:
-        - Text Content: {finding['text_content']}
-        - Finding: {finding['summary']}
-        - Category: {finding['category']}
-        - Severity: {finding['severity']}
-        - Recommendation: {finding['recommendation']}
-        
-        Question: {request.get('q', '')}
-        
-        Answer the question directly and helpfully, using the context provided.
-        """
+        context = {
+            "category": finding.category,
+            "summary": finding.summary,
+            "text_content": finding.text_content
+        }
         
-        response = await asyncio.to_thread(
-            llm.chat.completions.create,
+        response = await llm.chat.completions.create(
             messages=[{"role": "user", "content": prompt}],
             model="llama-3.1-8b-instant",
             temperature=0.1,
             max_tokens=500,
+            stream=stream,
         )
         
+        if stream:
+            return StreamingResponse(
+                _stream_chat_events(response, finding_id, context),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache"},
+            )
+        
         # Clean the response to remove reasoning and improve formatting
         answer = response.choices[0].message.content
         answer = clean_chat_response(answer)
@@ -888,11 +1548,7 @@ async def contextual_chat(finding_id: int, request: Dict[str, str]):
         return {
             "answer": answer,
             "finding_id": finding_id,
-            "context": {
-                "category": finding['category'],
-                "summary": finding['summary'],
-                "text_content": finding['text_content']
-            }
+            "context": context
         }
         
     except HTTPException:
@@ -0,0 +1,42 @@
+"""PDF text extraction that runs inside the PDF worker processes.
+
+Kept free of app imports: forkserver workers import this module to unpickle the submitted
+function, so it must not pull in app.py's clients, tokenizer or FastAPI app.
+"""
+
+from typing import Any, Dict, List, Optional
+
+import fitz
+
+# Text blocks are stored struct-of-arrays: {"text": [...], "page": [...], "bbox": [[x0, y0, x1, y1], ...]}.
+# Parallel lists avoid repeating every key per block, which keeps the cached JSON small.
+TextBlocks = Dict[str, List[Any]]
+
+def empty_text_blocks() -> TextBlocks:
+    return {"text": [], "page": [], "bbox": []}
+
+# Same flags as get_text("blocks") minus image blocks, so MuPDF never decodes images
+TEXTPAGE_FLAGS = fitz.TEXTFLAGS_BLOCKS & ~fitz.TEXT_PRESERVE_IMAGES
+
+def count_pages(pdf_path: str) -> int:
+    with fitz.open(pdf_path, filetype="pdf") as doc:
+        return doc.page_count
+
+def extract_page_range(pdf_path: str, start: int, stop: Optional[int] = None) -> TextBlocks:
+    """Extracts text blocks for pages [start, stop); runs in a worker process for large PDFs."""
+    text_blocks = empty_text_blocks()
+    texts, pages, bboxes = text_blocks["text"], text_blocks["page"], text_blocks["bbox"]
+    with fitz.open(pdf_path, filetype="pdf") as doc:
+        for page_index in range(start, doc.page_count if stop is None else stop):
+            page_num = page_index + 1
+            # Flat (x0, y0, x1, y1, text, block_no, block_type) tuples; images are never extracted
+            textpage = doc.load_page(page_index).get_textpage(flags=TEXTPAGE_FLAGS)
+            for x0, y0, x1, y1, text, _block_no, block_type in textpage.extractBLOCKS():
+                if block_type != 0:
+                    continue
+                text = " ".join(text.split())
+                if text:
+                    texts.append(text)
+                    pages.append(page_num)
+                    bboxes.append([x0, y0, x1, y1])
+    return text_blocks
@@ -0,0 +1,36 @@
+"""Smoke checks for the /progress polling endpoint (run with `pytest` from frontend/api)."""
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app as api
+
+STATUSES = {"doc-pending": "pending", "doc-completed": "completed"}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    async def fake_rest_get(table, params):
+        assert table == "documents"
+        ids = [v.strip('"') for v in params["id"][len("in.("):-1].split(",")]
+        return [{"id": i, "analysis_status": STATUSES[i]} for i in ids if i in STATUSES]
+
+    monkeypatch.setattr(api, "supabase_client", object())
+    monkeypatch.setattr(api, "_rest_get", fake_rest_get)
+    api.progress_cache.clear()
+    return TestClient(api.app)
+
+
+@pytest.mark.parametrize("document_id, status, percent", [
+    ("doc-pending", "pending", 10),
+    ("doc-completed", "completed", 100),
+])
+def test_progress_reports_known_status(client, document_id, status, percent):
+    body = client.get(f"/progress/{document_id}").json()
+    assert body["status"] == status
+    assert body["progress"] == percent
+    assert body["status_code"] == api.STATUS_MAP[status][0]
+
+
+def test_progress_unknown_document(client):
+    assert client.get("/progress/missing").json()["status"] == "not_found"
@@ -0,0 +1,50 @@
+"""Smoke checks for upload size limits (run with `pytest` from frontend/api)."""
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app as api
+
+LIMIT = 4 * 1024 * 1024
+ORIGIN = {"origin": "http://localhost:3000"}
+
+
+@pytest.mark.parametrize("content_length, expected", [
+    ("5242880", False),
+    (str(LIMIT + 1), False),
+    (str(LIMIT), True),
+    (LIMIT, True),
+    ("1024", True),
+])
+def test_validate_upload_size_compares_declared_size(content_length, expected):
+    assert api.validate_upload_size(content_length, LIMIT) is expected
+
+
+@pytest.mark.parametrize("content_length", [None, "", "abc", "4.2MB"])
+def test_validate_upload_size_allows_unknown_size(content_length):
+    # Unknown sizes are enforced while streaming in the handler instead
+    assert api.validate_upload_size(content_length, LIMIT) is True
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(api, "supabase_client", None)
+    return TestClient(api.app)
+
+
+def test_oversized_ingest_rejected_before_handler(client):
+    response = client.post(
+        "/ingest",
+        content=b"0" * (6 * 1024 * 1024),
+        headers={"content-type": "multipart/form-data; boundary=x", **ORIGIN},
+    )
+    assert response.status_code == 413
+    # CORS wraps the size check, so the browser can read the rejection
+    assert response.headers["access-control-allow-origin"] == "*"
+
+
+def test_progress_unaffected_by_size_check(client):
+    response = client.get("/progress/doc-pending", headers=ORIGIN)
+    assert response.status_code == 200
+    assert response.json()["message"] == "Database not configured"
+    assert response.headers["access-control-allow-origin"] == "*"
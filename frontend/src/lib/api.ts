@@ -101,6 +101,7 @@ export const apiService = {
 
   async getProgress(documentId: string): Promise<{
     status: string;
+    status_code?: number | null;
     progress: number;
     message: string;
     timestamp: string;